@@ -1,17 +1,35 @@
 # bot.py — 一次チェックを廃止し、直前チェックだけで5本を組み上げる高速版
+import bisect
 import json
 import os
+import pickle
+
+# ★ orjson があればC実装で状態のload/saveを高速化（無ければ stdlib json）
+try:
+    import orjson
+
+    def _loads(raw: bytes):
+        return orjson.loads(raw)
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _loads(raw: bytes):
+        return json.loads(raw)
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 import re
 import time
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from dateutil import tz
 import tweepy
-from playwright.sync_api import sync_playwright
 
 import requests
 from requests_oauthlib import OAuth1  # ★追加：OAuth1 署名
 
-from goxplorer import collect_fresh_gofile_urls, is_gofile_alive
+import browser_pool
+from goxplorer import collect_fresh_gofile_urls, probe_many
 
 # ===== 設定 =====
 AFFILIATE_URL = "https://amzn.to/41WDNsq"
@@ -36,26 +54,63 @@ def _default_state():
         "posted_urls": [],
         "last_post_date": None,
         "posts_today": 0,
-        "recent_urls_24h": [],
+        # 24h以内の投稿URL。追記順＝時刻昇順の並行リストで持つ
+        # （dictのリスト＋ISOパースよりpurgeもJSONも軽い）
+        "recent_ts": [],
+        "recent_url": [],
         "line_seq": 1,
+        "me": None,
     }
 
 def load_state():
     if not os.path.exists(STATE_FILE):
         return _default_state()
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(STATE_FILE, "rb") as f:
+            data = _loads(f.read())
     except Exception:
         data = _default_state()
     for k, v in _default_state().items():
         if k not in data:
             data[k] = v
+    _migrate_recent_urls(data)
     return data
 
+def _migrate_recent_urls(data):
+    """旧形式 recent_urls_24h（dictのリスト）を ts/url の並行リストへ移行。"""
+    old = data.pop("recent_urls_24h", None)
+    if not old:
+        return
+    pairs = []
+    for item in old:
+        try:
+            ts = datetime.fromisoformat(item.get("ts")).timestamp()
+        except Exception:
+            continue
+        pairs.append((ts, item.get("url")))
+    pairs.sort()
+    data["recent_ts"].extend(t for t, _ in pairs)
+    data["recent_url"].extend(u for _, u in pairs)
+
+# posted_urls の保持上限（無制限に伸びると保存のたびに全件シリアライズする）
+POSTED_URLS_CAP = 10000
+
+# 直近に書き込んだ内容（変更がなければ save_state はno-op）
+_LAST_SAVED = None
+
 def save_state(state):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    global _LAST_SAVED
+    if len(state.get("posted_urls", [])) > POSTED_URLS_CAP:
+        state["posted_urls"] = state["posted_urls"][-POSTED_URLS_CAP:]
+    payload = _dumps(state)
+    if payload == _LAST_SAVED:
+        return
+    # 一時ファイル→os.replace で原子的に置換（書き込み途中で死んでも壊れない）
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, STATE_FILE)
+    _LAST_SAVED = payload
 
 def reset_if_new_day(state, now_jst):
     today_str = now_jst.date().isoformat()
@@ -70,65 +125,141 @@ def can_post_more_today(state):
     return state.get("posts_today", 0) < DAILY_LIMIT
 
 def purge_recent_24h(state, now_utc: datetime):
-    cutoff = now_utc - timedelta(hours=24)
-    buf = []
-    for item in state.get("recent_urls_24h", []):
-        try:
-            ts = datetime.fromisoformat(item.get("ts"))
-        except Exception:
-            continue
-        if ts >= cutoff:
-            buf.append(item)
-    state["recent_urls_24h"] = buf
+    cutoff = now_utc.timestamp() - 24 * 3600
+    # 追記順＝時刻昇順なので、境界を二分探索して先頭を切り詰めるだけでよい
+    i = bisect.bisect_left(state["recent_ts"], cutoff)
+    if i:
+        state["recent_ts"] = state["recent_ts"][i:]
+        state["recent_url"] = state["recent_url"][i:]
 
 # ===== 正規化＆除外集合 =====
 def normalize_url(u: str) -> str:
     if not u:
         return u
-    u = u.strip()
-    u = re.sub(r"^http://", "https://", u, flags=re.I)
-    u = u.rstrip("/")
+    u = u.strip().rstrip("/")
+    # http:// → https://（正規表現は不要。履歴全件に対して毎回呼ばれる）
+    if u[:7].lower() == "http://":
+        u = "https://" + u[7:]
     return u
 
-def build_seen_set_from_state(state) -> set:
-    seen = set()
+# ★ pybloom_live があれば Bloom フィルタで既出判定（履歴が増えても省メモリ）
+try:
+    from pybloom_live import ScalableBloomFilter
+except ImportError:
+    ScalableBloomFilter = None
+
+BLOOM_FILE = "seen.bloom"
+
+class SeenUrls:
+    """
+    既出URLの membership コンテナ。
+    直近の履歴（posted_urls の保持分＋24h分）は実 set で正確に持ち、
+    キャップで切り捨てた過去分は seen.bloom に永続化した Bloom フィルタが
+    カバーする（FP率0.1%。誤検出は「生きたURLを1本見送る」だけで無害）。
+    """
+    def __init__(self):
+        self._exact = set()
+        self._bloom = None
+        if ScalableBloomFilter is not None:
+            self._bloom = self._load_bloom()
+
+    @staticmethod
+    def _load_bloom():
+        if os.path.exists(BLOOM_FILE):
+            try:
+                with open(BLOOM_FILE, "rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                pass
+        return ScalableBloomFilter(initial_capacity=100000, error_rate=0.001)
+
+    def add(self, url: str):
+        if not url:
+            return
+        self._exact.add(url)
+        if self._bloom is not None:
+            self._bloom.add(url)
+
+    def update(self, urls):
+        for u in urls:
+            self.add(u)
+
+    def __contains__(self, url: str) -> bool:
+        if url in self._exact:
+            return True
+        return self._bloom is not None and url in self._bloom
+
+    def save(self):
+        if self._bloom is None:
+            return
+        try:
+            tmp = BLOOM_FILE + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(self._bloom, f)
+            os.replace(tmp, BLOOM_FILE)
+        except Exception as e:
+            print(f"[warn] bloom save failed: {e}")
+
+def build_seen_set_from_state(state) -> SeenUrls:
+    seen = SeenUrls()
     for u in state.get("posted_urls", []):
         seen.add(normalize_url(u))
-    for item in state.get("recent_urls_24h", []):
-        seen.add(normalize_url(item.get("url")))
+    for u in state.get("recent_url", []):
+        seen.add(normalize_url(u))
     return seen
 
 # ===== ユーティリティ =====
-def estimate_tweet_len_tco(text: str) -> int:
-    def repl(m): return "U" * TCO_URL_LEN
-    replaced = re.sub(r"https?://\S+", repl, text)
-    return len(replaced)
+_URL_RE = re.compile(r"https?://\S+")
+_TCO_PLACEHOLDER = "U" * TCO_URL_LEN
 
-def is_alive_retry(url: str, retries: int = 1, delay_sec: float = 0.5) -> bool:
-    for i in range(retries + 1):
-        if is_gofile_alive(url):
-            return True
-        if i < retries:
-            time.sleep(delay_sec)
-    return False
+def estimate_tweet_len_tco(text: str) -> int:
+    return len(_URL_RE.sub(_TCO_PLACEHOLDER, text))
+
+def fit_to_tweet_limit(status_text: str) -> str:
+    """
+    280字に収める。不可視文字は一括除去する
+    （rstripのwhile回しは除去対象が尽きると無限ループになる）。
+    """
+    if estimate_tweet_len_tco(status_text) <= TWEET_LIMIT:
+        return status_text
+    status_text = status_text.replace(". https://", ".https://")
+    if estimate_tweet_len_tco(status_text) <= TWEET_LIMIT:
+        return status_text
+    return status_text.replace(ZWSP, "").replace(ZWNJ, "")
 
 # ===== ツイート本文（5件固定＋通し番号） =====
+# 16bitシードの不可視署名をニブル単位で引く表（毎回16個の1文字strを作らない）
+_SIG_NIBBLE = ["".join(INVISIBLES[(n >> i) & 1] for i in range(4)) for n in range(16)]
+
+def _invisible_sig(seed: int) -> str:
+    return (_SIG_NIBBLE[seed & 0xF]
+            + _SIG_NIBBLE[(seed >> 4) & 0xF]
+            + _SIG_NIBBLE[(seed >> 8) & 0xF]
+            + _SIG_NIBBLE[(seed >> 12) & 0xF])
+
 def compose_fixed5_text(gofile_urls, start_seq: int, salt_idx: int = 0, add_sig: bool = True):
     invis = INVISIBLES[salt_idx % len(INVISIBLES)]
-    lines = []
     seq = start_seq
     take = min(5, len(gofile_urls))
     sel = gofile_urls[:take]
-    for i, u in enumerate(sel):
-        lines.append(f"{seq}{invis}. {u}")
-        if i < take - 1:
-            lines.append(AFFILIATE_URL)
-        seq += 1
-    text = "\n".join(lines)
+    if take == 5:
+        # 通常パス（常に5本）はアンロールして1本のf文字列で組む
+        u1, u2, u3, u4, u5 = sel
+        text = (f"{seq}{invis}. {u1}\n{AFFILIATE_URL}\n"
+                f"{seq + 1}{invis}. {u2}\n{AFFILIATE_URL}\n"
+                f"{seq + 2}{invis}. {u3}\n{AFFILIATE_URL}\n"
+                f"{seq + 3}{invis}. {u4}\n{AFFILIATE_URL}\n"
+                f"{seq + 4}{invis}. {u5}")
+    else:
+        lines = []
+        for i, u in enumerate(sel):
+            lines.append(f"{seq + i}{invis}. {u}")
+            if i < take - 1:
+                lines.append(AFFILIATE_URL)
+        text = "\n".join(lines)
     if add_sig:
         seed = (start_seq * 1315423911) ^ int(time.time() // 60)
-        sig = "".join(INVISIBLES[(seed >> i) & 1] for i in range(16))
-        text = text + sig
+        text = text + _invisible_sig(seed)
     return text, take
 
 # ===== X API / Tweepy =====
@@ -140,18 +271,30 @@ def get_client():
         consumer_secret=os.environ["X_API_SECRET"],
         access_token=os.environ["X_ACCESS_TOKEN"],
         access_token_secret=os.environ["X_ACCESS_TOKEN_SECRET"],
-        wait_on_rate_limit=True,
+        # True だと429時にtweepy内部で最長15分スリープし、
+        # HARD_LIMIT_SEC のウォッチドッグが効かないまま予算を食い潰す。
+        # 429は tweepy.TooManyRequests として呼び出し側で処理する。
+        wait_on_rate_limit=False,
     )
     return client
 
-def fetch_recent_urls_via_api(client, max_tweets=100) -> tuple[set, str | None]:
+def fetch_recent_urls_via_api(client, max_tweets=100, state=None) -> tuple[set, str | None]:
     seen = set()
-    me = client.get_me(user_auth=True)
-    user = me.data if me and me.data else None
-    if not user:
-        return seen, None
-    user_id = user.id
-    username = getattr(user, "username", None)
+    # get_me は75req/15minのレート制限枠を消費し、結果は変わらないのでstateにキャッシュ
+    me_cache = (state or {}).get("me") or {}
+    if me_cache.get("id"):
+        user_id = me_cache["id"]
+        username = me_cache.get("username")
+    else:
+        me = client.get_me(user_auth=True)
+        user = me.data if me and me.data else None
+        if not user:
+            return seen, None
+        user_id = user.id
+        username = getattr(user, "username", None)
+        if state is not None:
+            state["me"] = {"id": user_id, "username": username}
+            save_state(state)
     resp = client.get_users_tweets(
         id=user_id,
         max_results=min(max_tweets, 100),
@@ -160,43 +303,39 @@ def fetch_recent_urls_via_api(client, max_tweets=100) -> tuple[set, str | None]:
     )
     if resp and resp.data:
         for t in resp.data:
-            text = t.text or ""
-            for m in GOFILE_RE.findall(text):
-                seen.add(normalize_url(m))
+            # 本文＋entity内URLをひとまとめにして findall を1回で済ます
+            parts = [t.text or ""]
             ent = getattr(t, "entities", None)
             if ent and "urls" in ent and ent["urls"]:
                 for u in ent["urls"]:
                     for key in ("expanded_url", "unwound_url", "display_url", "url"):
                         val = u.get(key)
-                        if isinstance(val, str) and "gofile.io/d/" in val:
-                            for mm in GOFILE_RE.findall(val):
-                                seen.add(normalize_url(mm))
+                        if isinstance(val, str):
+                            parts.append(val)
+            for m in GOFILE_RE.findall(" ".join(parts)):
+                seen.add(normalize_url(m))
     return seen, username
 
-def fetch_recent_urls_via_web(username: str, scrolls: int = 3, wait_ms: int = 1000) -> set:
+def fetch_recent_urls_via_web(username: str, scrolls: int = 3, wait_ms: int = 1000, context=None) -> set:
     if not username:
         return set()
     url = f"https://x.com/{username}"
     seen = set()
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True, args=["--no-sandbox"])
-        context = browser.new_context(
-            user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/123.0.0.0 Safari/123.0.0.0"),
-            locale="ja-JP"
-        )
-        page = context.new_page()
+    # goxplorer 側と同じ永続ブラウザを共有（context を注入可能）
+    if context is None:
+        context = browser_pool.get_context()
+    page = context.new_page()
+    try:
         page.goto(url, wait_until="domcontentloaded", timeout=30000)
         page.wait_for_timeout(wait_ms)
         for _ in range(scrolls):
             page.mouse.wheel(0, 2200)
             page.wait_for_timeout(wait_ms)
         html = page.content()
-        context.close()
-        browser.close()
-    for m in GOFILE_RE.findall(html):
-        seen.add(normalize_url(m))
+    finally:
+        page.close()
+    for m in GOFILE_RE.finditer(html):
+        seen.add(normalize_url(m.group(0)))
     return seen
 
 # --- コミュニティ投稿（/2/tweets に community_id を渡す） ---
@@ -252,69 +391,86 @@ def main():
 
     # 1) state由来の既知重複
     already_seen = build_seen_set_from_state(state)
+    # posted_urls のO(N)線形走査を避けるための集合（O(1)で既出判定）
+    posted_set = set(state["posted_urls"])
 
     # 2) タイムライン既出（API→Web）
     client = get_client()
     timeline_seen = set()
     username = None
     try:
-        timeline_seen, username = fetch_recent_urls_via_api(client, max_tweets=100)
+        timeline_seen, username = fetch_recent_urls_via_api(client, max_tweets=100, state=state)
         print(f"[info] recent timeline gofiles via API: {len(timeline_seen)} (user={username})")
     except tweepy.Unauthorized:
         username = os.getenv("X_SCREEN_NAME", username)
         web_seen = fetch_recent_urls_via_web(username=username, scrolls=3, wait_ms=1000) if username else set()
         timeline_seen = web_seen
         print(f"[info] recent timeline gofiles via WEB: {len(timeline_seen)} (user={username})")
+    except tweepy.TooManyRequests as e:
+        # レート制限枯渇。ブロックせず即Webフォールバックに切り替える
+        reset = None
+        try:
+            reset = e.response.headers.get("x-rate-limit-reset")
+        except Exception:
+            pass
+        print(f"[warn] API rate limited (reset={reset}); falling back to WEB.")
+        username = os.getenv("X_SCREEN_NAME") or (state.get("me") or {}).get("username")
+        timeline_seen = fetch_recent_urls_via_web(username=username, scrolls=3, wait_ms=1000) if username else set()
+        print(f"[info] recent timeline gofiles via WEB: {len(timeline_seen)} (user={username})")
     if timeline_seen:
-        already_seen |= timeline_seen
+        already_seen.update(timeline_seen)
 
     # 3) まず軽めに収集
     if time.monotonic() - start_ts > HARD_LIMIT_SEC:
         print("[warn] time budget exceeded before collection; abort.")
         return
+    # 死活確認はこの後の直前チェックで一括して行う（collect側と二重にGETしない）
     candidates = collect_fresh_gofile_urls(
         already_seen=already_seen,
         want=25,
-        num_pages=10
+        num_pages=10,
+        verify=False
     )
     print(f"[info] collected candidates: {len(candidates)}")
     if len(candidates) < 5:
         print("Not enough fresh URLs found; skip.")
         return
 
-    # 4) 直前チェックだけで5本を組む
+    # 4) 直前チェックだけで5本を組む（未テスト分をまとめて並列プローブ）
     target = 5
     tested = set()
     preflight = []
 
-    def add_if_alive(u: str):
-        if time.monotonic() - start_ts > HARD_LIMIT_SEC:
-            return False
-        n = normalize_url(u)
-        if n in tested or n in already_seen or n in preflight:
-            return False
-        tested.add(n)
-        if is_alive_retry(n, retries=1, delay_sec=0.5):
-            preflight.append(n)
-            return True
-        return False
-
-    for u in candidates:
-        if len(preflight) >= target or (time.monotonic() - start_ts) > HARD_LIMIT_SEC:
-            break
-        add_if_alive(u)
+    def probe_batch(urls):
+        room = target - len(preflight)
+        if room <= 0 or (time.monotonic() - start_ts) > HARD_LIMIT_SEC:
+            return
+        fresh = []
+        for u in urls:
+            n = normalize_url(u)
+            if n in tested or n in already_seen or n in preflight:
+                continue
+            tested.add(n)
+            fresh.append(n)
+        # ウォッチドッグ期限をプローブ側にも渡す（途中のバッチでも打ち切れるように）
+        for n in probe_many(fresh, room, deadline=start_ts + HARD_LIMIT_SEC):
+            if len(preflight) < target:
+                preflight.append(n)
+
+    probe_batch(candidates)
 
     if len(preflight) < target and (time.monotonic() - start_ts) <= HARD_LIMIT_SEC:
+        # プローブ済み・確保済みも既出扱いにして再収集（このrun内ではもう触らない）
+        already_seen.update(preflight)
+        already_seen.update(tested)
         extra = collect_fresh_gofile_urls(
-            already_seen=already_seen | set(preflight) | tested,
+            already_seen=already_seen,
             want=40,
-            num_pages=12
+            num_pages=12,
+            verify=False
         )
         print(f"[info] extra collected for preflight: {len(extra)}")
-        for u in extra:
-            if len(preflight) >= target or (time.monotonic() - start_ts) > HARD_LIMIT_SEC:
-                break
-            add_if_alive(u)
+        probe_batch(extra)
 
     if len(preflight) < target:
         print("Final preflight could not assemble 5 URLs; skip.")
@@ -327,10 +483,7 @@ def main():
     status_text, _ = compose_fixed5_text(preflight, start_seq=start_seq, salt_idx=salt, add_sig=True)
 
     # 280字調整
-    if estimate_tweet_len_tco(status_text) > TWEET_LIMIT:
-        status_text = status_text.replace(". https://", ".https://")
-    while estimate_tweet_len_tco(status_text) > TWEET_LIMIT:
-        status_text = status_text.rstrip(ZWSP + ZWNJ)
+    status_text = fit_to_tweet_limit(status_text)
 
     # 6) 投稿（コミュニティ優先。未設定なら通常ポスト）
     community_id = os.getenv("X_COMMUNITY_ID", "").strip()
@@ -347,12 +500,16 @@ def main():
 
         # 7) 状態更新（投稿に使ったURLのみ既出扱い）
         for u in preflight[:5]:
-            if u not in state["posted_urls"]:
+            if u not in posted_set:
                 state["posted_urls"].append(u)
-            state["recent_urls_24h"].append({"url": u, "ts": now_utc.isoformat()})
+                posted_set.add(u)
+            state["recent_ts"].append(now_utc.timestamp())
+            state["recent_url"].append(u)
         state["posts_today"] = state.get("posts_today", 0) + 1
         state["line_seq"] = start_seq + 5
         save_state(state)
+        already_seen.update(preflight[:5])
+        already_seen.save()
         print(f"Posted (5 gofiles):", status_text)
         return
 
@@ -366,10 +523,7 @@ def main():
         if "duplicate content" in s:
             salt = (salt + 1) % len(INVISIBLES)
             status_text, _ = compose_fixed5_text(preflight, start_seq=start_seq, salt_idx=salt, add_sig=True)
-            if estimate_tweet_len_tco(status_text) > TWEET_LIMIT:
-                status_text = status_text.replace(". https://", ".https://")
-            while estimate_tweet_len_tco(status_text) > TWEET_LIMIT:
-                status_text = status_text.rstrip(ZWSP + ZWNJ)
+            status_text = fit_to_tweet_limit(status_text)
             print("[warn] duplicate content; retry with new invisible salt.")
             time.sleep(1.0)
             try:
@@ -381,12 +535,16 @@ def main():
                     tweet_id = resp.data.get("id") if resp and resp.data else None
                 print(f"[info] retry success tweet_id={tweet_id}")
                 for u in preflight[:5]:
-                    if u not in state["posted_urls"]:
+                    if u not in posted_set:
                         state["posted_urls"].append(u)
-                    state["recent_urls_24h"].append({"url": u, "ts": now_utc.isoformat()})
+                        posted_set.add(u)
+                    state["recent_ts"].append(now_utc.timestamp())
+                    state["recent_url"].append(u)
                 state["posts_today"] = state.get("posts_today", 0) + 1
                 state["line_seq"] = start_seq + 5
                 save_state(state)
+                already_seen.update(preflight[:5])
+                already_seen.save()
                 return
             except Exception as e2:
                 print(f"[error] retry failed: {e2}")
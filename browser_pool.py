@@ -0,0 +1,67 @@
+# browser_pool.py — Playwright/Chromium の永続プール（goxplorer / bot 共用）
+import atexit
+
+from playwright.sync_api import sync_playwright
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/123.0.0.0 Safari/537.36"
+)
+
+# レンダリング負荷を下げる起動オプション
+_CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--mute-audio",
+    "--no-zygote",
+]
+
+# URL抽出に不要なリソース（画像・フォント等）は取得しない
+_BLOCKED_RESOURCE_TYPES = ("image", "font", "media", "stylesheet")
+
+def _route_filter(route):
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+_PW = None
+_BROWSER = None
+_CTX = None
+
+def get_context():
+    """
+    共有の BrowserContext を返す（初回だけ Chromium を起動してキャッシュ）。
+    呼び出し側は page を開閉するだけでよい。プロセス内のどこから呼んでも
+    同じブラウザを使い回すので、Chromium のコールドスタートは最大1回。
+    """
+    global _PW, _BROWSER, _CTX
+    if _CTX is not None:
+        return _CTX
+    _PW = sync_playwright().start()
+    _BROWSER = _PW.chromium.launch(headless=True, args=_CHROMIUM_ARGS)
+    _CTX = _BROWSER.new_context(
+        user_agent=USER_AGENT,
+        locale="ja-JP"
+    )
+    _CTX.route("**/*", _route_filter)
+    atexit.register(shutdown)
+    return _CTX
+
+def shutdown():
+    """プロセス終了時に一度だけブラウザを畳む（atexit登録）。"""
+    global _PW, _BROWSER, _CTX
+    try:
+        if _CTX is not None:
+            _CTX.close()
+        if _BROWSER is not None:
+            _BROWSER.close()
+        if _PW is not None:
+            _PW.stop()
+    except Exception:
+        pass
+    _PW = _BROWSER = _CTX = None
@@ -1,28 +1,65 @@
+import heapq
 import os
 import re
+import threading
 import time
 import random
-from typing import List, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Set, Tuple
 
 import cloudscraper
 import requests
 from bs4 import BeautifulSoup
 
-# ★ Playwright フォールバック
-from playwright.sync_api import sync_playwright
+# ★ httpx があれば一覧取得を HTTP/2 で多重化（チャレンジ解決は cloudscraper 担当）
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# ★ Playwright フォールバック（永続ブラウザは browser_pool が一元管理）
+import browser_pool
 
 BASE_LIST_URL = "https://goxplorer.net/?sortBy=download&filePage={page}"
 
 # gofile URLパターン（生HTML/スクリプト内も対象）
 GOFILE_RE = re.compile(r"https?://gofile\.io/d/[A-Za-z0-9]+")
 
+# bytes版（ページ全体の走査はデコード不要のバイト列に対して1回だけ行う）
+_GOFILE_BYTES_RE = re.compile(rb"https?://gofile\.io/d/[A-Za-z0-9]+")
+
+# "123 downloads" 表記（aタグ近傍のDL数抽出用。毎回コンパイルしない）
+_DL_RE = re.compile(r"(\d[\d,]*)\s*downloads?", re.I)
+
+# gofile詳細ページの死亡文言（小文字で照合）
+_DEATH_MARKERS = (
+    "this content does not exist",
+    "the content you are looking for could not be found",
+    "has been automatically removed",
+    "has been deleted by the owner",
+)
+
+# ★ pyahocorasick があれば複数文言を1パスで走査（無ければ in 連打）
+try:
+    import ahocorasick
+    _DEATH_AUTOMATON = ahocorasick.Automaton()
+    for _m in _DEATH_MARKERS:
+        _DEATH_AUTOMATON.add_word(_m, _m)
+    _DEATH_AUTOMATON.make_automaton()
+except ImportError:
+    _DEATH_AUTOMATON = None
+
+def _has_death_marker(lowered: str) -> bool:
+    """死亡文言の有無を判定。lowered は casefold 済みの本文。"""
+    if _DEATH_AUTOMATON is not None:
+        for _ in _DEATH_AUTOMATON.iter(lowered):
+            return True
+        return False
+    return any(m in lowered for m in _DEATH_MARKERS)
+
 # 本物ブラウザ風のヘッダ
 HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/123.0.0.0 Safari/537.36"
-    ),
+    "User-Agent": browser_pool.USER_AGENT,
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
     "Accept-Language": "ja-JP,ja;q=0.9,en-US;q=0.8,en;q=0.7",
     "Referer": "https://goxplorer.net/",
@@ -50,6 +87,40 @@ def _build_scraper():
     scraper.headers.update(HEADERS)
     return scraper
 
+# cloudscraper はJSチャレンジ解決＋TLS構築が重いので1個を使い回す
+# （keep-aliveの接続プールも効く）
+_SCRAPER = None
+
+def _get_scraper():
+    global _SCRAPER
+    if _SCRAPER is None:
+        _SCRAPER = _build_scraper()
+    return _SCRAPER
+
+class _RateLimiter:
+    """
+    goxplorer.net への負荷軽減用の簡易トークンバケット。
+    並列フェッチでもドメイン全体で毎秒 rate リクエストまでに抑える。
+    """
+    def __init__(self, rate: float = 2.0):
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_at:
+                sleep_for = self._next_at - now
+                self._next_at += self._interval
+            else:
+                sleep_for = 0.0
+                self._next_at = now + self._interval
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+
+_RATE_LIMIT = _RateLimiter(rate=2.0)
+
 def fix_scheme(url: str) -> str:
     """htps:// → https:// のようなタイポ救済"""
     if url.startswith("htps://"):
@@ -59,15 +130,25 @@ def fix_scheme(url: str) -> str:
 def _extract_items_from_html(html: str) -> List[Tuple[str, int]]:
     """
     ページから (gofile_url, downloads) を抽出。
-    1) aタグ近傍の "123 downloads" を優先
-    2) それでゼロなら、生HTML全文（script含む）から強制的にURL列挙
+    1) 生HTML全文（script含む）からURLを列挙
+    2) aタグ近傍の "123 downloads" でDL数を付与
     """
-    soup = BeautifulSoup(html, "html.parser")
+    # --- 1) まず生HTML全体をバイト列のまま1パス走査（URLが無ければDOMを作らない）
+    raw = html.encode("utf-8", errors="ignore") if isinstance(html, str) else html
+    raw_urls = {fix_scheme(m.group(0).decode("ascii", errors="ignore"))
+                for m in _GOFILE_BYTES_RE.finditer(raw)}
+    if not raw_urls:
+        return []
+
+    soup = BeautifulSoup(html, "lxml")
     items: List[Tuple[str, int]] = []
+    annotated: Set[str] = set()
 
-    # --- 1) a[href] から抽出（DL数も拾う）
+    # --- 2) a[href] からDL数を拾う
     for a in soup.find_all("a", href=GOFILE_RE):
         url = fix_scheme(a.get("href", ""))
+        if url in annotated:
+            continue
 
         # 近傍テキストに "123 downloads" のような表記がないか探索
         downloads = 0
@@ -80,7 +161,7 @@ def _extract_items_from_html(html: str) -> List[Tuple[str, int]]:
                 pass
         blob = " ".join(text_blobs)
 
-        m = re.search(r"(\d[\d,]*)\s*downloads?", blob, flags=re.I)
+        m = _DL_RE.search(blob)
         if m:
             try:
                 downloads = int(m.group(1).replace(",", ""))
@@ -88,29 +169,96 @@ def _extract_items_from_html(html: str) -> List[Tuple[str, int]]:
                 downloads = 0
 
         items.append((url, downloads))
+        annotated.add(url)
 
-    # --- 2) 生HTML全体（script含む）からURLを強制抽出（DL数は0）
-    raw_urls = set(GOFILE_RE.findall(html))
-    if raw_urls:
-        existing = {u for u, _ in items}
-        for u in raw_urls:
-            u = fix_scheme(u)
-            if u not in existing:
-                items.append((u, 0))
+    # --- 3) aタグに現れなかったURL（script内など）はDL数0で追加
+    for u in raw_urls - annotated:
+        items.append((u, 0))
 
     return items
 
+# cloudscraper が解決した Cookie/UA を引き継ぐ HTTP/2 クライアント。
+# 同一オリジンへ小さいGETを束で撃つので、多重化＋ヘッダ圧縮が効く。
+_HTTP2 = None
+_HTTP2_LOCK = threading.Lock()
+
+def _build_http2_client(scraper):
+    kwargs = {}
+    if scraper.proxies:
+        kwargs["proxies"] = {f"{k}://": v for k, v in scraper.proxies.items()}
+    return httpx.Client(
+        http2=True,
+        headers=dict(scraper.headers),
+        cookies={c.name: c.value for c in scraper.cookies},
+        timeout=20,
+        follow_redirects=True,
+        **kwargs,
+    )
+
+def _warm_scraper(scraper):
+    """
+    goxplorer.net を1回実際に取得して Cloudflare チャレンジを解かせ、
+    cf_clearance Cookie をジャーに載せる（セッション構築だけでは空のまま）。
+    """
+    try:
+        scraper.get(BASE_LIST_URL.format(page=1), timeout=20, allow_redirects=True)
+    except requests.RequestException as e:
+        print(f"[warn] scraper warmup failed: {e}")
+
+def _get_http2_client():
+    if httpx is None:
+        return None
+    global _HTTP2
+    with _HTTP2_LOCK:
+        if _HTTP2 is None:
+            scraper = _get_scraper()
+            _warm_scraper(scraper)
+            _HTTP2 = _build_http2_client(scraper)
+        return _HTTP2
+
+def _refresh_http2_client():
+    """403（cf_clearance失効）時に cloudscraper で Cookie を取り直す。"""
+    global _SCRAPER, _HTTP2
+    with _HTTP2_LOCK:
+        if _HTTP2 is not None:
+            try:
+                _HTTP2.close()
+            except Exception:
+                pass
+            _HTTP2 = None
+        _SCRAPER = _build_scraper()
+        _warm_scraper(_SCRAPER)
+        if httpx is not None:
+            _HTTP2 = _build_http2_client(_SCRAPER)
+
+_RETRYABLE_ERRORS = (requests.HTTPError, requests.RequestException) + (
+    (httpx.HTTPError,) if httpx is not None else ()
+)
+
 def _get_with_retry(scraper, url: str, timeout: int = 20, max_retry: int = 4):
     """
     403/5xx等に備えて、指数バックオフ＋ジッターで数回リトライ。
+    httpx があれば HTTP/2 で取得し、403のときだけ Cookie を更新して再挑戦。
     """
     for attempt in range(1, max_retry + 1):
         try:
+            client = _get_http2_client()
+            if client is not None:
+                r = client.get(url, timeout=timeout)
+                if r.status_code == 403:
+                    # cf_clearance失効の可能性。Cookieを取り直しつつ、
+                    # この試行はチャレンジを解ける cloudscraper 本体で続行
+                    _refresh_http2_client()
+                    scraper = _get_scraper()
+                elif r.status_code >= 400:
+                    raise requests.HTTPError(f"{r.status_code} for {url}")
+                else:
+                    return r
             r = scraper.get(url, timeout=timeout, allow_redirects=True)
             if r.status_code >= 400:
                 raise requests.HTTPError(f"{r.status_code} for {url}", response=r)
             return r
-        except (requests.HTTPError, requests.RequestException) as e:
+        except _RETRYABLE_ERRORS:
             if attempt == max_retry:
                 raise
             base = 0.9 * (2 ** (attempt - 1))
@@ -119,14 +267,11 @@ def _get_with_retry(scraper, url: str, timeout: int = 20, max_retry: int = 4):
 def _fetch_page_with_playwright(url: str, wait_ms: int = 4000) -> str:
     """
     Playwrightで実ページをレンダリングしてHTMLを取得（JS実行後のDOM）。
+    ブラウザは永続プールを再利用し、ページだけ開閉する。
     """
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True, args=["--no-sandbox"])
-        context = browser.new_context(
-            user_agent=HEADERS["User-Agent"],
-            locale="ja-JP"
-        )
-        page = context.new_page()
+    context = browser_pool.get_context()
+    page = context.new_page()
+    try:
         # 追加ヘッダ
         page.set_extra_http_headers({
             "Accept": HEADERS["Accept"],
@@ -135,72 +280,183 @@ def _fetch_page_with_playwright(url: str, wait_ms: int = 4000) -> str:
             "Connection": "keep-alive",
         })
         page.goto(url, wait_until="domcontentloaded", timeout=30000)
-        # JSで描画が進む時間を少し与える
-        page.wait_for_timeout(wait_ms)
-        html = page.content()
-        context.close()
-        browser.close()
-        return html
+        # gofileリンクが描画された時点で即返す（出ないページは wait_ms で諦める）
+        try:
+            page.wait_for_selector("a[href*='gofile.io/d/']", timeout=wait_ms)
+        except Exception:
+            pass
+        return page.content()
+    finally:
+        page.close()
+
+def _needs_js_render(html: str) -> bool:
+    """
+    cloudscraper が返したHTMLが「JSシェル」（未レンダリングのSPA殻）か判定。
+    本文に gofile URL が1つも無く、かつ JS フレームワークの痕跡がある場合のみ
+    Playwright での再取得に意味がある。静的HTMLで0件なら本当に0件。
+    """
+    if "gofile.io/d/" in html:
+        return False
+    return "__next" in html or "<script" in html[:2048].lower()
+
+def _fetch_listing_page(scraper, p: int) -> Tuple[List[Tuple[str, int]], Optional[str]]:
+    """1ページ分を cloudscraper で取得（ワーカースレッドから呼ばれる）。"""
+    list_url = BASE_LIST_URL.format(page=p)
+    try:
+        _RATE_LIMIT.wait()
+        r = _get_with_retry(scraper, list_url, timeout=25, max_retry=4)
+        return _extract_items_from_html(r.text), r.text
+    except Exception as e:
+        print(f"[warn] cloudscraper page {p} failed: {e}")
+        return [], None
 
 def fetch_listing_pages(num_pages: int = 10) -> List[Tuple[str, int]]:
     """
     goxplorer の一覧ページを巡回し、(url, ダウンロード数) を収集。
-    まず cloudscraper。0件なら Playwright で再取得。
+    まず cloudscraper を並列で回し、0件のページだけ Playwright で再取得。
     """
-    scraper = _build_scraper()
+    scraper = _get_scraper()
     results: List[Tuple[str, int]] = []
-    for p in range(1, num_pages + 1):
+    needs_fallback: List[int] = []
+
+    # 1) cloudscraper（I/O待ちが支配的なので並列化。レート制限は _RATE_LIMIT が担保）
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        futures = {ex.submit(_fetch_listing_page, scraper, p): p
+                   for p in range(1, num_pages + 1)}
+        for fut in as_completed(futures):
+            p = futures[fut]
+            items, html = fut.result()
+            if items:
+                print(f"[info] page {p}: extracted {len(items)} items")
+                results.extend(items)
+            elif html is None or _needs_js_render(html):
+                needs_fallback.append(p)
+            else:
+                # 静的HTMLは取れたがURLが無い → ブラウザで再取得しても増えない
+                print(f"[info] page {p}: extracted 0 items (static, no fallback)")
+
+    # 2) Playwright フォールバック
+    #    （sync API はスレッド間で共有できないため、メインスレッドで順次実行）
+    for p in sorted(needs_fallback):
         list_url = BASE_LIST_URL.format(page=p)
-        items: List[Tuple[str, int]] = []
-        # 1) cloudscraper
+        items = []
         try:
-            r = _get_with_retry(scraper, list_url, timeout=25, max_retry=4)
-            items = _extract_items_from_html(r.text)
+            html = _fetch_page_with_playwright(list_url)
+            items = _extract_items_from_html(html)
         except Exception as e:
-            print(f"[warn] cloudscraper page {p} failed: {e}")
-
-        # 2) Playwright フォールバック
-        if not items:
-            try:
-                html = _fetch_page_with_playwright(list_url)
-                items = _extract_items_from_html(html)
-            except Exception as e:
-                print(f"[warn] playwright page {p} failed: {e}")
-
-        print(f"[info] page {p}: extracted {len(items)} items")
+            print(f"[warn] playwright page {p} failed: {e}")
+        print(f"[info] page {p}: extracted {len(items)} items (fallback)")
         results.extend(items)
-        time.sleep(1.0)  # サイト負荷軽減
+
     return results
 
+def _get_body_head(scraper, url: str, timeout: int, max_retry: int = 3) -> Tuple[str, bool]:
+    """
+    本文の先頭8KiB以上を読んで (text, eof) で返す（死亡文言はページ先頭に現れる）。
+    チャンク転送では1チャンクが8KiBに満たないことがあるので、貯まるまで読み足す。
+    eof は本文を最後まで読み切ったかどうか。リトライ方針は _get_with_retry と同じ。
+    """
+    for attempt in range(1, max_retry + 1):
+        r = None
+        try:
+            r = scraper.get(url, timeout=timeout, allow_redirects=True, stream=True)
+            if r.status_code >= 400:
+                raise requests.HTTPError(f"{r.status_code} for {url}", response=r)
+            buf = b""
+            eof = True
+            for chunk in r.iter_content(8192):
+                buf += chunk
+                if len(buf) >= 8192:
+                    eof = False  # まだ続きがあるかもしれない
+                    break
+            return buf.decode("utf-8", errors="ignore"), eof
+        except (requests.HTTPError, requests.RequestException):
+            if attempt == max_retry:
+                raise
+            base = 0.9 * (2 ** (attempt - 1))
+            time.sleep(base + random.uniform(0, base))
+        finally:
+            if r is not None:
+                r.close()
+    return "", True
+
 def is_gofile_alive(url: str, timeout: int = 20) -> bool:
     """
     gofile詳細ページの死活判定。
     指定の死亡文言や404等で死にリンクとみなす。
+    まず HEAD（本文転送なし）、その後は先頭8KiBだけ読む。
     """
     url = fix_scheme(url)
-    scraper = _build_scraper()
+    scraper = _get_scraper()
+
+    # 1) HEAD でステータスだけ確認（404/410/451 なら本文を引かずに即死判定）
     try:
-        r = _get_with_retry(scraper, url, timeout=timeout, max_retry=3)
-        text = r.text
-        death_markers = [
-            "This content does not exist",
-            "The content you are looking for could not be found",
-            "has been automatically removed",
-            "has been deleted by the owner",
-        ]
-        if any(m.lower() in text.lower() for m in death_markers):
+        r = scraper.head(url, timeout=timeout, allow_redirects=True)
+        if r.status_code in (404, 410, 451):
             return False
-        if len(text) < 500 and ("error" in text.lower() or "not found" in text.lower()):
+    except requests.RequestException:
+        pass  # HEAD非対応・一時エラーはGET側で判定
+
+    # 2) 200でも死亡文言つきのページがあるので先頭だけGET
+    try:
+        text, eof = _get_body_head(scraper, url, timeout=timeout, max_retry=3)
+        lowered = text.casefold()  # 小文字化は1回だけ
+        if _has_death_marker(lowered):
+            return False
+        # 「本文全体が短い」判定は本当に読み切ったときだけ適用する
+        if eof and len(text) < 500 and ("error" in lowered or "not found" in lowered):
             return False
         return True
     except Exception:
         return False
 
+def probe_many(
+    urls: List[str], want: int, max_workers: int = 8,
+    deadline: Optional[float] = None,
+) -> List[str]:
+    """
+    複数URLを並列に死活判定し、want 本生き残った時点で打ち切る。
+    各プローブは gofile.io への数秒のRTT待ちなので並列化がそのまま効く。
+    deadline（time.monotonic基準）を過ぎたら未投入分を捨てて即打ち切る。
+    戻り値は urls の並び順（＝ランキング順）を保つ。
+    """
+    if not urls or want <= 0:
+        return []
+
+    def expired() -> bool:
+        return deadline is not None and time.monotonic() > deadline
+
+    alive: List[str] = []
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        # max_workers 単位の波で投入し、期限切れ時に実行中プローブを残さない
+        for start in range(0, len(urls), max_workers):
+            if len(alive) >= want or expired():
+                break
+            wave = urls[start:start + max_workers]
+            futures = {ex.submit(is_gofile_alive, u): u for u in wave}
+            for fut in as_completed(futures):
+                try:
+                    ok = fut.result()
+                except Exception:
+                    ok = False
+                if ok:
+                    alive.append(futures[fut])
+                if len(alive) >= want or expired():
+                    for f in futures:
+                        f.cancel()
+                    break
+    order = {u: i for i, u in enumerate(urls)}
+    alive.sort(key=lambda u: order[u])
+    return alive[:want]
+
 def collect_fresh_gofile_urls(
-    already_seen: Set[str], want: int = 20, num_pages: int = 10
+    already_seen: Set[str], want: int = 20, num_pages: int = 10, verify: bool = True
 ) -> List[str]:
     """
-    ダウンロード数が多い順に新規URLを返す（死にリンク・重複除外）。
+    ダウンロード数が多い順に新規URLを返す（重複除外）。
+    verify=True なら死活確認済みの最大 want 本。
+    verify=False なら未確認の候補を最大 want*3 本返す
+    （呼び出し側が直前にまとめてプローブする場合の二重GET回避用）。
     """
     items = fetch_listing_pages(num_pages=num_pages)
 
@@ -210,18 +466,17 @@ def collect_fresh_gofile_urls(
         if url not in best or dl > best[url]:
             best[url] = dl
 
-    # ダウンロード数降順で並べ替え
-    ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)
+    # 既出URLを除いてからダウンロード数降順の上位だけ取る（全件ソートは不要）。
+    # 先に切り詰めると上位が既出で埋まり、新規が1本も残らなくなる。
+    ranked = heapq.nlargest(
+        want * 3,
+        ((url, dl) for url, dl in best.items() if url not in already_seen),
+        key=lambda x: x[1],
+    )
+    candidates = [url for url, _dl in ranked]
 
-    uniq: List[str] = []
-    seen_now: Set[str] = set()
-    for url, _dl in ranked:
-        if url in already_seen or url in seen_now:
-            continue
-        if not is_gofile_alive(url):
-            continue
-        uniq.append(url)
-        seen_now.add(url)
-        if len(uniq) >= want:
-            break
-    return uniq
+    if not verify:
+        return candidates
+
+    # 上位（wantの3倍）をまとめて並列プローブし、生き残りを返す
+    return probe_many(candidates, want)